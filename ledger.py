@@ -1,12 +1,50 @@
 import logging
-from collections import deque, defaultdict
+import sys
+from bisect import bisect_left
+from collections import defaultdict
 from decimal import Decimal
-from typing import Any, Dict, List, Optional
+from itertools import accumulate, islice
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 # Настройка базового логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Суммы внутри кошелька хранятся в целых минимальных единицах (10^-8)
+SCALE = 10 ** 8
+# Тот же множитель в виде Decimal: операции с ним не конвертируют int в Decimal каждый раз
+_DECIMAL_SCALE = Decimal(SCALE)
+_FLOAT_SCALE = float(SCALE)
+# Точность сумм, отдаваемых наружу (6 знаков после запятой)
+_OUTPUT_QUANT = Decimal("1e-6")
+# Минимальное число списанных партий, при котором очередь сжимается
+COMPACT_MIN = 64
+
+
+def _to_units(value: Decimal) -> int:
+    """Перевод суммы в целые минимальные единицы."""
+    return int(value * _DECIMAL_SCALE)
+
+
+def _from_units(units: int) -> Decimal:
+    """Перевод минимальных единиц обратно в Decimal."""
+    return Decimal(units) / _DECIMAL_SCALE
+
+
+def _from_units_rounded(units: int) -> Decimal:
+    """Перевод минимальных единиц в Decimal с округлением до 6 знаков."""
+    return (Decimal(units) / _DECIMAL_SCALE).quantize(_OUTPUT_QUANT)
+
+
+def _check_deposit(amount: Decimal, fee: Decimal) -> None:
+    """Проверка суммы и комиссии пополнения."""
+    if amount < 0:
+        raise InvalidOperationError("Deposit amount must be non-negative.")
+    if fee < 0:
+        raise InvalidOperationError("Fee must be non-negative.")
+    if amount < fee:
+        raise InvalidOperationError("Fee cannot exceed deposit amount.")
+
 
 class LedgerError(Exception):
     """Базовое исключение для ошибок кошелька."""
@@ -23,23 +61,73 @@ class InvalidOperationError(LedgerError):
     pass
 
 
-class Party:
+class Source(NamedTuple):
     """
-    Описывает одну партию средств (депозит).
+    Источник списания: какая часть партии ушла на сумму, на комиссию и сколько исходной суммы.
+    Суммы в минимальных единицах (см. SCALE).
     """
-    __slots__ = ("tx_id", "current_amount", "original_amount", "original_currency")
+    tx_id: Any
+    amount_taken: int
+    fee_taken: int
+    original_used: int
+    original_currency: str
+
 
-    def __init__(
+class CurrencyBook:
+    """
+    FIFO-очередь партий одной валюты в виде параллельных списков с индексом головы.
+    Суммы хранятся в минимальных единицах (см. SCALE). Списанные партии
+    не удаляются по одной, а отсекаются пачкой при сжатии.
+    cumulative хранит нарастающий итог чистых сумм партий за все время, spent — сколько
+    из этого итога уже списано; граница списания находится бинарным поиском.
+    """
+    __slots__ = ("tx_ids", "current", "original", "original_currencies", "cumulative", "spent", "head")
+
+    def __init__(self) -> None:
+        self.tx_ids: List[Any] = []
+        self.current: List[int] = []
+        self.original: List[int] = []
+        self.original_currencies: List[str] = []
+        self.cumulative: List[int] = []
+        self.spent = 0
+        self.head = 0
+
+    def append(self, tx_id: Any, current_amount: int, original_amount: int, original_currency: str) -> None:
+        """Добавить партию в конец очереди."""
+        self.tx_ids.append(tx_id)
+        self.current.append(current_amount)
+        self.original.append(original_amount)
+        self.original_currencies.append(original_currency)
+        self.cumulative.append((self.cumulative[-1] if self.cumulative else self.spent) + current_amount)
+
+    def extend(
             self,
-            tx_id: Any,
-            current_amount: Decimal,
-            original_amount: Decimal,
+            tx_ids: List[Any],
+            current_amounts: List[int],
+            original_amounts: List[int],
             original_currency: str,
     ) -> None:
-        self.tx_id = tx_id
-        self.current_amount = current_amount
-        self.original_amount = original_amount
-        self.original_currency = original_currency
+        """Добавить пачку партий одной исходной валюты в конец очереди."""
+        base = self.cumulative[-1] if self.cumulative else self.spent
+        self.tx_ids.extend(tx_ids)
+        self.current.extend(current_amounts)
+        self.original.extend(original_amounts)
+        self.original_currencies.extend([original_currency] * len(current_amounts))
+        self.cumulative.extend(islice(accumulate(current_amounts, initial=base), 1, None))
+
+    def compact(self) -> None:
+        """
+        Удалить списанные партии, если их накопилось не меньше COMPACT_MIN
+        и они занимают больше половины списков.
+        """
+        head = self.head
+        if head >= COMPACT_MIN and head * 2 > len(self.current):
+            del self.tx_ids[:head]
+            del self.current[:head]
+            del self.original[:head]
+            del self.original_currencies[:head]
+            del self.cumulative[:head]
+            self.head = 0
 
 
 class Ledger:
@@ -48,8 +136,10 @@ class Ledger:
     """
 
     def __init__(self) -> None:
-        self.ledger: Dict[str, deque[Party]] = defaultdict(deque)
+        self.ledger: Dict[str, CurrencyBook] = defaultdict(CurrencyBook)
         self.total_deposited: Dict[str, Decimal] = defaultdict(Decimal)
+        # Текущий баланс по валютам, поддерживается инкрементально
+        self._balances: Dict[str, int] = defaultdict(int)
 
     def deposit(self, amount: Decimal, currency: str, tx_id: Any, fee: Decimal) -> None:
         """
@@ -59,107 +149,193 @@ class Ledger:
         :param tx_id: Идентификатор транзакции
         :param fee: Комиссия (>=0, не больше суммы)
         """
-        if amount < 0:
-            raise InvalidOperationError("Deposit amount must be non-negative.")
-        if fee < 0:
-            raise InvalidOperationError("Fee must be non-negative.")
-        if amount < fee:
-            raise InvalidOperationError("Fee cannot exceed deposit amount.")
+        _check_deposit(amount, fee)
 
-        net_amount = amount - fee
-        party = Party(tx_id, net_amount, amount, currency)
-        self.ledger[currency].append(party)
+        # Коды валют интернируются: ключи словарей сравниваются по идентичности,
+        # а все партии ссылаются на одну строку
+        currency = sys.intern(currency)
+        net_amount = _to_units(amount) - _to_units(fee)
+        self.ledger[currency].append(tx_id, net_amount, _to_units(amount), currency)
         self.total_deposited[currency] += amount
-        logger.info(f"Deposited {amount} {currency} (fee {fee}), tx_id={tx_id}")
+        self._balances[currency] += net_amount
+        logger.info("Deposited %s %s (fee %s), tx_id=%s", amount, currency, fee, tx_id)
+
+    def deposit_many(self, items: Iterable[Tuple[Decimal, str, Any, Decimal]]) -> None:
+        """
+        Пакетное пополнение: партии группируются по валюте и добавляются одной операцией.
+        Если хотя бы одна запись некорректна, кошелек не изменяется.
+        :param items: Записи (сумма, валюта, идентификатор транзакции, комиссия)
+        """
+        # Валюта -> (tx_id, чистые суммы, исходные суммы, сумма пополнений)
+        batches: Dict[str, Tuple[List[Any], List[int], List[int], List[Decimal]]] = {}
+        for amount, currency, tx_id, fee in items:
+            _check_deposit(amount, fee)
+            currency = sys.intern(currency)
+            batch = batches.get(currency)
+            if batch is None:
+                batch = batches[currency] = ([], [], [], [])
+            units = _to_units(amount)
+            batch[0].append(tx_id)
+            batch[1].append(units - _to_units(fee))
+            batch[2].append(units)
+            batch[3].append(amount)
+
+        count = 0
+        for currency, (tx_ids, current_amounts, original_amounts, amounts) in batches.items():
+            self.ledger[currency].extend(tx_ids, current_amounts, original_amounts, currency)
+            self.total_deposited[currency] += sum(amounts)
+            self._balances[currency] += sum(current_amounts)
+            count += len(tx_ids)
+        logger.info("Deposited %s parties in %s currencies", count, len(batches))
 
     def _spend_funds(
-            self, currency: str, total_amount: Decimal, fee: Decimal
-    ) -> List[Dict[str, Any]]:
+            self,
+            currency: str,
+            total_amount: Decimal,
+            fee: Decimal,
+            dest: Optional[Tuple[str, Decimal]] = None,
+    ) -> List[Source]:
         """
         Внутренний метод списания средств с пропорциональным распределением комиссии.
         :param currency: Валюта списания
         :param total_amount: Сумма списания
         :param fee: Комиссия
-        :return: Список источников списания
+        :param dest: Валюта и сумма зачисления при конвертации; тогда новые партии
+            создаются прямо при списании, а источники не возвращаются
+        :return: Список источников списания (суммы в минимальных единицах)
         """
         if total_amount < 0 or fee < 0:
             raise InvalidOperationError("Amount and fee must be non-negative.")
-        available_balance = self.balance().get(currency, Decimal("0"))
-        if available_balance < total_amount + fee:
+        currency = sys.intern(currency)
+        amount_units = _to_units(total_amount)
+        total_needed = amount_units + _to_units(fee)
+        available_balance = self._balances.get(currency, 0)
+        if available_balance < total_needed:
             raise InsufficientFundsError(
-                f"Insufficient funds in {currency} ({available_balance} < {total_amount + fee})")
-
-        remaining_amount = total_amount
-        remaining_fee = fee
-        sources: List[Dict[str, Any]] = []
-
-        while remaining_amount + remaining_fee > Decimal("0"):
-            if not self.ledger[currency]:
-                break
-
-            party = self.ledger[currency][0]
-            available = party.current_amount
-
-            if remaining_amount + remaining_fee <= available:
-                total_to_take = remaining_amount + remaining_fee
-                ratio = (remaining_amount / total_to_take) if total_to_take > 0 else Decimal("0")
-                amount_taken = ratio * total_to_take
-                fee_taken = total_to_take - amount_taken
-                party.current_amount -= total_to_take
-                remaining_amount = Decimal("0")
-                remaining_fee = Decimal("0")
-            else:
-                total_to_take = available
-                ratio = (remaining_amount / (remaining_amount + remaining_fee)) if (
-                                                                                           remaining_amount + remaining_fee) > 0 else Decimal(
-                    "0")
-                amount_taken = ratio * total_to_take
-                fee_taken = total_to_take - amount_taken
-                remaining_amount -= amount_taken
-                remaining_fee -= fee_taken
-                party.current_amount = Decimal("0")
-
-            original_used = (
-                party.original_amount * (total_to_take / available)
-                if available > 0 else Decimal("0")
-            )
-
-            sources.append(
-                {
-                    "tx_id": party.tx_id,
-                    "amount_taken": amount_taken,
-                    "fee_taken": fee_taken,
-                    "original_used": original_used,
-                    "original_currency": party.original_currency,
-                }
-            )
-            party.original_amount -= original_used
+                f"Insufficient funds in {currency} "
+                f"({_from_units(available_balance)} < {total_amount + fee})")
 
-            if party.current_amount <= Decimal("0"):
-                self.ledger[currency].popleft()
+        dest_book = None
+        if dest is not None:
+            dest_currency = sys.intern(dest[0])
+            units_to = _to_units(dest[1]) if amount_units > 0 else 0
+            dest_book = self.ledger[dest_currency]
+            self._balances.setdefault(dest_currency, 0)
+        if total_needed == 0:
+            return []
 
-        logger.info(f"Spent {total_amount} {currency} (fee {fee}), sources used: {len(sources)}")
+        book = self.ledger[currency]
+        tx_ids = book.tx_ids
+        current = book.current
+        original = book.original
+        original_currencies = book.original_currencies
+        head = book.head
+        end = len(current)
+        sources: List[Source] = []
+        # Доля суммы в списании (amount_units / total_needed) неизменна на протяжении всего цикла,
+        # поэтому сумма делится по накопленному итогу: округления не копятся, итог сходится точно.
+        # Сумма зачисления при конвертации делится по тому же накопленному итогу taken, а не по уже
+        # округленной сумме: иначе ошибка округления умножалась бы на курс
+        taken = 0
+        amount_before = 0
+        converted_before = 0
+
+        # Первая партия, на которой нарастающий итог достигает нужной суммы; все партии до нее
+        # покрываются списанием целиком и отдают всю исходную сумму без деления.
+        # Пустая партия (депозит, целиком ушедший в комиссию) ничего не отдает.
+        # Частый случай, когда хватает первой партии, обходится без поиска
+        if current[head] >= total_needed:
+            boundary = head
+        else:
+            boundary = bisect_left(book.cumulative, book.spent + total_needed, head, end)
+        parties_used = boundary - head
+        for i in range(head, boundary):
+            available = current[i]
+            taken += available
+            amount_after = taken * amount_units // total_needed
+            amount_taken = amount_after - amount_before
+            if dest_book is None:
+                sources.append(Source(
+                    tx_ids[i],
+                    amount_taken,
+                    available - amount_taken,
+                    original[i] if available else 0,
+                    original_currencies[i],
+                ))
+            elif amount_taken > 0:
+                converted_after = taken * units_to // total_needed
+                dest_book.append(tx_ids[i], converted_after - converted_before, original[i], original_currencies[i])
+                converted_before = converted_after
+            amount_before = amount_after
+        head = boundary
+
+        # Остаток списывается с граничной партии
+        if head < end:
+            available = current[head]
+            total_to_take = total_needed - taken
+            taken = total_needed
+            parties_used += 1
+            amount_taken = amount_units - amount_before
+            original_used = original[head] * total_to_take // available
+            if dest_book is None:
+                sources.append(Source(
+                    tx_ids[head],
+                    amount_taken,
+                    total_to_take - amount_taken,
+                    original_used,
+                    original_currencies[head],
+                ))
+            elif amount_taken > 0:
+                dest_book.append(tx_ids[head], units_to - converted_before, original_used, original_currencies[head])
+            current[head] = available - total_to_take
+            original[head] -= original_used
+            if total_to_take == available:
+                head += 1
+
+        book.spent += taken
+        book.head = head
+        book.compact()
+
+        self._balances[currency] -= taken
+        if dest_book is not None:
+            self._balances[dest_currency] += units_to
+        logger.info("Spent %s %s (fee %s), parties used: %s", total_amount, currency, fee, parties_used)
         return sources
 
-    def withdraw(self, amount: Decimal, currency: str, fee: Decimal) -> List[Dict[str, Any]]:
+    def withdraw(
+            self, amount: Decimal, currency: str, fee: Decimal, decimal_output: bool = True
+    ) -> List[Dict[str, Any]]:
         """
         Снятие средств с возвратом информации об источниках.
         :param amount: Снимаемая сумма
         :param currency: Валюта
         :param fee: Комиссия
+        :param decimal_output: Суммы в результате как Decimal с округлением до 6 знаков;
+            при False — как float (для отображения и JSON)
         :return: Список источников списания
         """
         sources = self._spend_funds(currency, amount, fee)
-        result = [
-            {
-                "tx_id": src["tx_id"],
-                "amount_withdrawn": round(src["amount_taken"], 6),
-                "original_amount": round(src["original_used"], 6),
-                "original_currency": src["original_currency"],
-            }
-            for src in sources
-        ]
-        logger.info(f"Withdrawn {amount} {currency} (fee {fee})")
+        if decimal_output:
+            result = [
+                {
+                    "tx_id": src.tx_id,
+                    "amount_withdrawn": _from_units_rounded(src.amount_taken),
+                    "original_amount": _from_units_rounded(src.original_used),
+                    "original_currency": src.original_currency,
+                }
+                for src in sources
+            ]
+        else:
+            result = [
+                {
+                    "tx_id": src.tx_id,
+                    "amount_withdrawn": src.amount_taken / _FLOAT_SCALE,
+                    "original_amount": src.original_used / _FLOAT_SCALE,
+                    "original_currency": src.original_currency,
+                }
+                for src in sources
+            ]
+        logger.info("Withdrawn %s %s (fee %s)", amount, currency, fee)
         return result
 
     def convert(
@@ -178,34 +354,17 @@ class Ledger:
         :param currency_to: Валюта зачисления
         :param fee: Комиссия
         """
-        sources = self._spend_funds(currency_from, amount_from, fee)
-
-        if currency_to not in self.ledger:
-            self.ledger[currency_to] = deque()
-
-        for source in sources:
-            if source["amount_taken"] > Decimal("0"):
-                ratio = (
-                    source["amount_taken"] / amount_from
-                    if amount_from > 0 else Decimal("0")
-                )
-                converted_amount = ratio * amount_to
-                new_party = Party(
-                    tx_id=source["tx_id"],
-                    current_amount=converted_amount,
-                    original_amount=source["original_used"],
-                    original_currency=source["original_currency"],
-                )
-                self.ledger[currency_to].append(new_party)
-        logger.info(f"Converted {amount_from} {currency_from} → {amount_to} {currency_to} (fee {fee})")
+        self._spend_funds(currency_from, amount_from, fee, dest=(currency_to, amount_to))
+        logger.info(
+            "Converted %s %s → %s %s (fee %s)", amount_from, currency_from, amount_to, currency_to, fee
+        )
 
     def balance(self) -> Dict[str, Decimal]:
         """
         Возвращает баланс по всем валютам с округлением.
         :return: Словарь {валюта: сумма}
         """
-        return {currency: round(sum(party.current_amount for party in queue), 6)
-                for currency, queue in self.ledger.items()}
+        return {currency: _from_units_rounded(units) for currency, units in self._balances.items()}
 
     def get_history(self, currency: Optional[str] = None) -> List[Dict[str, Any]]:
         """
@@ -216,11 +375,15 @@ class Ledger:
         result = []
         currencies = [currency] if currency else self.ledger.keys()
         for curr in currencies:
-            for party in self.ledger[curr]:
+            book = self.ledger[curr]
+            head = book.head
+            for tx_id, current_amount, original_amount, original_currency in zip(
+                    book.tx_ids[head:], book.current[head:], book.original[head:], book.original_currencies[head:]
+            ):
                 result.append({
-                    "tx_id": party.tx_id,
-                    "current_amount": party.current_amount,
-                    "original_amount": party.original_amount,
-                    "original_currency": party.original_currency,
+                    "tx_id": tx_id,
+                    "current_amount": _from_units(current_amount),
+                    "original_amount": _from_units(original_amount),
+                    "original_currency": original_currency,
                 })
         return result
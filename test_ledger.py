@@ -13,6 +13,25 @@ def test_deposit_and_balance():
     assert l.balance() == {"USDT": Decimal("200")}
 
 
+def test_deposit_many():
+    l = Ledger()
+    l.deposit_many([
+        (Decimal("110"), "USDT", "t1", Decimal("10")),
+        (Decimal("50"), "EUR", "e1", Decimal("0")),
+        (Decimal("110"), "USDT", "t2", Decimal("10")),
+    ])
+    assert l.balance() == {"USDT": Decimal("200"), "EUR": Decimal("50")}
+    assert [h["tx_id"] for h in l.get_history("USDT")] == ["t1", "t2"]
+    assert l.withdraw(Decimal("150"), "USDT", Decimal("10"))[1]["original_amount"] == Decimal("66")
+
+    with pytest.raises(InvalidOperationError):
+        l.deposit_many([
+            (Decimal("10"), "EUR", "e2", Decimal("0")),
+            (Decimal("10"), "EUR", "e3", Decimal("15")),
+        ])
+    assert l.balance() == {"USDT": Decimal("40"), "EUR": Decimal("50")}
+
+
 def test_withdraw_fifo_and_fee():
     l = Ledger()
     l.deposit(Decimal("110"), "USDT", "t1", Decimal("10"))
@@ -47,6 +66,38 @@ def test_withdraw_fifo_and_fee():
     assert l.balance() == {"USDT": Decimal("0")}
 
 
+def test_withdraw_empty_party_reports_zero_original():
+    l = Ledger()
+    l.deposit(Decimal("10"), "USDT", "z", Decimal("10"))
+    l.deposit(Decimal("110"), "USDT", "t1", Decimal("10"))
+    assert l.withdraw(Decimal("50"), "USDT", Decimal("0")) == [
+        {
+            "original_amount": Decimal("0"),
+            "amount_withdrawn": Decimal("0"),
+            "original_currency": "USDT",
+            "tx_id": "z",
+        },
+        {
+            "original_amount": Decimal("55"),
+            "amount_withdrawn": Decimal("50"),
+            "original_currency": "USDT",
+            "tx_id": "t1",
+        },
+    ]
+    assert l.balance() == {"USDT": Decimal("50")}
+
+
+def test_withdraw_float_output():
+    l = Ledger()
+    l.deposit(Decimal("110"), "USDT", "t1", Decimal("10"))
+    l.deposit(Decimal("110"), "USDT", "t2", Decimal("10"))
+    assert l.withdraw(Decimal("150"), "USDT", Decimal("10"), decimal_output=False) == [
+        {"original_amount": 110.0, "amount_withdrawn": 93.75, "original_currency": "USDT", "tx_id": "t1"},
+        {"original_amount": 66.0, "amount_withdrawn": 56.25, "original_currency": "USDT", "tx_id": "t2"},
+    ]
+    assert l.balance() == {"USDT": Decimal("40")}
+
+
 def test_convert_and_withdraw_after():
     l = Ledger()
     l.deposit(Decimal("110"), "USDT", "t1", Decimal("10"))
@@ -57,6 +108,82 @@ def test_convert_and_withdraw_after():
     assert l.balance() == {"USDT": Decimal("40"), "ABC": Decimal("80")}
 
 
+def test_convert_keeps_exact_total():
+    l = Ledger()
+    for tx_id in ("t1", "t2", "t3"):
+        l.deposit(Decimal("1"), "USDT", tx_id, Decimal("0"))
+    l.convert(Decimal("3"), "USDT", Decimal("1"), "ABC", Decimal("0"))
+    assert l.balance() == {"USDT": Decimal("0"), "ABC": Decimal("1")}
+    l.withdraw(Decimal("1"), "ABC", Decimal("0"))
+    assert l.balance() == {"USDT": Decimal("0"), "ABC": Decimal("0")}
+
+
+def test_convert_high_rate_keeps_party_proportions():
+    l = Ledger()
+    for tx_id in ("b1", "b2", "b3"):
+        l.deposit(Decimal("1"), "BTC", tx_id, Decimal("0"))
+    l.convert(Decimal("2"), "BTC", Decimal("10000000"), "JPY", Decimal("1"))
+    h = l.get_history("JPY")
+    assert [p["tx_id"] for p in h] == ["b1", "b2", "b3"]
+    assert [p["current_amount"] for p in h] == [
+        Decimal("3333333.33333333"),
+        Decimal("3333333.33333333"),
+        Decimal("3333333.33333334"),
+    ]
+    assert [p["original_amount"] for p in h] == [Decimal("1"), Decimal("1"), Decimal("1")]
+    assert l.balance() == {"BTC": Decimal("0"), "JPY": Decimal("10000000")}
+
+
+def test_withdraw_across_compaction():
+    l = Ledger()
+    for i in range(40):
+        l.deposit(Decimal("1.1"), "USDT", f"t{i}", Decimal("0.1"))
+    l.deposit_many([(Decimal("1.1"), "USDT", f"t{i}", Decimal("0.1")) for i in range(40, 70)])
+
+    # 65 партий снимаются целиком, граничная t65 — наполовину; список партий сжимается
+    res = l.withdraw(Decimal("65.5"), "USDT", Decimal("0"))
+    assert len(res) == 66
+    assert res[-1] == {
+        "original_amount": Decimal("0.55"),
+        "amount_withdrawn": Decimal("0.5"),
+        "original_currency": "USDT",
+        "tx_id": "t65",
+    }
+    assert l.balance() == {"USDT": Decimal("4.5")}
+    h = l.get_history("USDT")
+    assert [p["tx_id"] for p in h] == ["t65", "t66", "t67", "t68", "t69"]
+    assert h[0]["current_amount"] == Decimal("0.5")
+    assert h[0]["original_amount"] == Decimal("0.55")
+
+    # Списание через старую границу: остаток t65, целые t66..t69 и половина новой партии
+    l.deposit(Decimal("1.1"), "USDT", "n1", Decimal("0.1"))
+    l.deposit_many([(Decimal("1.1"), "USDT", "n2", Decimal("0.1"))])
+    res = l.withdraw(Decimal("5"), "USDT", Decimal("0"))
+    assert [(r["tx_id"], r["amount_withdrawn"], r["original_amount"]) for r in res] == [
+        ("t65", Decimal("0.5"), Decimal("0.55")),
+        ("t66", Decimal("1"), Decimal("1.1")),
+        ("t67", Decimal("1"), Decimal("1.1")),
+        ("t68", Decimal("1"), Decimal("1.1")),
+        ("t69", Decimal("1"), Decimal("1.1")),
+        ("n1", Decimal("0.5"), Decimal("0.55")),
+    ]
+    assert l.balance() == {"USDT": Decimal("1.5")}
+
+    # Полное списание опустошает списки; новые партии продолжают нарастающий итог
+    l.deposit_many([(Decimal("1.1"), "USDT", f"m{i}", Decimal("0.1")) for i in range(70)])
+    assert len(l.withdraw(Decimal("71.5"), "USDT", Decimal("0"))) == 72
+    assert l.balance() == {"USDT": Decimal("0")}
+    assert l.get_history("USDT") == []
+    l.deposit_many([(Decimal("1.1"), "USDT", "n3", Decimal("0.1"))])
+    l.deposit(Decimal("1.1"), "USDT", "n4", Decimal("0.1"))
+    res = l.withdraw(Decimal("1.5"), "USDT", Decimal("0"))
+    assert [(r["tx_id"], r["amount_withdrawn"], r["original_amount"]) for r in res] == [
+        ("n3", Decimal("1"), Decimal("1.1")),
+        ("n4", Decimal("0.5"), Decimal("0.55")),
+    ]
+    assert l.balance() == {"USDT": Decimal("0.5")}
+
+
 def test_exceptions():
     l = Ledger()
     with pytest.raises(InvalidOperationError):